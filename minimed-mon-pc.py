@@ -50,10 +50,18 @@
 
 from tkinter import *
 import threading
+import queue
+import os
 import time
 import datetime
-import requests as urequests
-import playsound # Needs GST binding (apt install python3-gst-1.0)
+import functools
+import email.utils
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import gi # Needs GST binding (apt install python3-gst-1.0)
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
 
 # Font mappings
 FONT_MONT_14 = 'Helvetica 10'
@@ -75,12 +83,21 @@ DEFAULT_PROXY_PORT = "8081"
 
 ntpserver = DEFAULT_NTP_SERVER
 timezone  = DEFAULT_TIME_ZONE
+tzHours   = int(timezone)
 
 # API
 API_URL   = "carelink/nohistory"
 proxyaddr = "0.0.0.0" # Replace with your Carelink Python Client IP address
 proxyport = 8081
 
+# HTTP client parameters
+HTTP_TIMEOUT_S = (3,10) # connect, read
+
+# Image files
+IMG_BATTERY   = {lvl: f"res/mm_batt{lvl}.png" for lvl in (0,25,50,75,100)}
+IMG_RESERVOIR = {lvl: f"res/mm_tank{lvl}.png" for lvl in (0,50,150,200)}
+IMG_SAGE      = {icon: f"res/mm_sage_{icon}.png" for icon in ("expired","unk","green","red")}
+
 # Gobal variables
 dstDelta     = 0
 lastUpdateTm = time.localtime(0)
@@ -88,9 +105,7 @@ lastAlarmId  = 0
 lastAlarmMsg = None
 lastErrorMsg = None
 lastApMsg    = None
-runNtpsync        = False
-runTimeupdate     = False
-runPumpdataupdate = False
+windowClosed = False
 
 
 #################################################
@@ -99,6 +114,11 @@ runPumpdataupdate = False
 #
 #################################################
 
+@functools.lru_cache(maxsize=32)
+def tk_color(color):
+   # Tk color string of RGB color value (only a handful of colors is used)
+   return "#%06X" % (color)
+
 class M5Screen:
    def __init__(self,icon=None):
       self.window = Tk()
@@ -117,33 +137,61 @@ class M5Screen:
       pass
 
 class M5Img:
+   # Decoded images shared by all instances, each file is loaded only once
+   imgCache = {}
+   def __load_img(self, img_file):
+      img = M5Img.imgCache.get(img_file)
+      if img == None:
+         img = PhotoImage(file=img_file)
+         M5Img.imgCache[img_file] = img
+      return img
    def __init__(self, img_file, x, y, parent):
-      self.img = PhotoImage(file=img_file)
+      self.img_file = img_file
+      self.img = self.__load_img(img_file)
+      self.hidden = False
       self.scr = parent
       self.img_h = self.scr.create_image(x,y,anchor=NW,image=self.img)
    def set_hidden(self,hidden):
+      if hidden == self.hidden:
+         return
+      self.hidden = hidden
       if hidden:
          self.scr.itemconfig(self.img_h, state='hidden')
       else:
          self.scr.itemconfig(self.img_h, state='normal')
    def set_img_src(self, img_file):
-      self.img = PhotoImage(file=img_file)
+      if img_file == self.img_file:
+         return
+      self.img_file = img_file
+      self.img = self.__load_img(img_file)
       self.scr.itemconfig(self.img_h,image=self.img)
    def set_pos(self, x, y):
       # TODO
       pass
 
 class M5Label:
+   # Measured text widths shared by all instances, per font and text
+   widthCache = {}
    def __init__(self, text, x, y, color, font, parent):
       self.scr = parent
-      self.txt_h = self.scr.create_text(x,y,anchor=NW,text=text,fill="#%06X" % (color),font=(font))
+      self.text = text
+      self.font = font
+      self.txt_h = self.scr.create_text(x,y,anchor=NW,text=text,fill=tk_color(color),font=(font))
    def set_text(self, text):
+      if text == self.text:
+         return
+      self.text = text
       self.scr.itemconfig(self.txt_h,text=text)
    def set_pos(self, x, y):
       self.scr.coords(self.txt_h,x,y)
    def get_width(self):
-      bounds = self.scr.bbox(self.txt_h)
-      return bounds[2] - bounds[0]
+      key = (self.font, self.text)
+      width = M5Label.widthCache.get(key)
+      if width == None:
+         bounds = self.scr.bbox(self.txt_h)
+         width = bounds[2] - bounds[0]
+         M5Label.widthCache[key] = width
+      return width
    def get_height(self):
       bounds = self.scr.bbox(self.txt_h)
       return bounds[3] - bounds[1]
@@ -165,22 +213,19 @@ class M5Msgbox:
       self.scr.delete(self.rect_h)
 
 class timerSch:
-   def __init__(self):
-      pass
+   # Timers are run by the Tk event loop, so the timer functions
+   # are executed in the main thread and can access the widgets
+   def __init__(self, parent):
+      self.window = parent
    def __periodic_timer(self, func, period):
-      print("start periodic_timer with %d s" %(period))
-      while True:
-         time.sleep(period)
-         func()
+      func()
+      self.window.after(period, self.__periodic_timer, func, period)
    def run(self, func, period, oneshot):
       if oneshot:
-         t = threading.Timer(period/1000, func)
-         t.daemon = True
-         t.start()
+         self.window.after(period, func)
       else:
-         t = threading.Thread(target=self.__periodic_timer, args=(func,period/1000))
-         t.daemon = True
-         t.start()
+         print("start periodic_timer with %d s" %(period/1000))
+         self.window.after(period, self.__periodic_timer, func, period)
    
    
 #################################################
@@ -192,6 +237,10 @@ class timerSch:
 class lcd:
    def __init__(self,parent):
       self.scr = parent
+      # Canvas items of the arcs drawn at each position, they are
+      # reused on redraw instead of piling up new items on the canvas
+      self.arcs = {}
+      self.arcsUsed = {}
    def arc(self, x, y, radius, thick, startpos, endpos, color1, color2):
       x1 = x-radius
       y1 = y-radius
@@ -199,8 +248,20 @@ class lcd:
       y2 = y+radius
       start = (360-startpos)+90
       extend = -endpos
-      outline = "#%06X" % (color1)
-      arc = self.scr.create_arc((x1,y1,x2,y2), start=start, extent=extend, style=ARC, width=thick, outline=outline)
+      outline = tk_color(color1)
+      pos = (x,y,radius)
+      arcs = self.arcs.setdefault(pos, [])
+      if startpos == 0 and endpos >= 359:
+         # Full circle paints over all previous arcs at this position
+         for arc in arcs[1:]:
+            self.scr.itemconfig(arc, state='hidden')
+         self.arcsUsed[pos] = 0
+      n = self.arcsUsed.get(pos, 0)
+      if n < len(arcs):
+         self.scr.itemconfig(arcs[n], start=start, extent=extend, width=thick, outline=outline, state='normal')
+      else:
+         arcs.append(self.scr.create_arc((x1,y1,x2,y2), start=start, extent=extend, style=ARC, width=thick, outline=outline))
+      self.arcsUsed[pos] = n+1
 
 class ntpclient:
    def __init__(self, host, timezone):
@@ -211,12 +272,28 @@ class ntpclient:
       return self.datetime.now().hour
    def minute(self):
       return self.datetime.now().minute
+   def now(self):
+      # Hour and minute from a single clock reading
+      now = self.datetime.now()
+      return (now.hour, now.minute)
 
 class speaker:
    def __init__(self):
-      self.playsound = playsound.playsound
+      Gst.init(None)
+      # One playback pipeline per sound file, built only once
+      self.players = {}
+   def load(self, sndfile):
+      player = self.players.get(sndfile)
+      if player == None:
+         player = Gst.ElementFactory.make('playbin', None)
+         player.set_property('uri', 'file://'+os.path.abspath(sndfile))
+         self.players[sndfile] = player
+      return player
    def playWAV(self, sndfile, rate):
-      self.playsound(sndfile)
+      player = self.load(sndfile)
+      # Restart playback from the beginning
+      player.set_state(Gst.State.NULL)
+      player.set_state(Gst.State.PLAYING)
    
 def wait_ms(time_ms):
    time.sleep(time_ms/1000)
@@ -227,9 +304,16 @@ print("Create screen")
 s=M5Screen('res/icon_mmm.png')
 scr1 = s.scr
 
-timerSch = timerSch()
+timerSch = timerSch(parent=s.window)
 lcd = lcd(parent=scr1)
 speaker = speaker()
+speaker.load("res/sound_alarm.wav")
+speaker.load("res/sound_alert.wav")
+
+# Create HTTP session used by the network thread
+# (keeps the connection to the proxy alive between polls)
+httpSession = requests.Session()
+httpSession.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=Retry(total=2, backoff_factor=0.3)))
 
 # Load images on screen 1
 print("Create images")
@@ -269,17 +353,19 @@ def align_text(label,pos,y):
         label.set_pos(x=320-label.get_width(),y=y)
 
 
-def time_delta(tm,ntp,timezone):
-   if tm != None and ntp != None:
-      delta_min  = ntp.minute() - tm[4]
+def time_delta(tm,now,tzhours):
+   # now is (hour, minute) local time, tzhours the time zone as int
+   if tm != None and now != None:
+      hour,minute = now
+      delta_min  = minute - tm[4]
       if delta_min < 0:
          delta_min += 60
       #print("delta_min: "+str(delta_min))
-      #delta_hour = ntp.hour() - (tm[3]+int(timezone)+dstDelta)
-      delta_hour = ntp.hour() - (tm[3]+int(timezone))
+      #delta_hour = hour - (tm[3]+tzhours+dstDelta)
+      delta_hour = hour - (tm[3]+tzhours)
       if delta_hour < 0:
          delta_hour += 24
-      #print("myHour: %d devHour: %d, dstDelta: %d" % (ntp.hour(),tm[3],dstDelta))
+      #print("myHour: %d devHour: %d, dstDelta: %d" % (hour,tm[3],dstDelta))
       #print("delta_hour: "+str(delta_hour))
       
       if delta_min == 0 and delta_hour == 0:
@@ -293,16 +379,16 @@ def time_delta(tm,ntp,timezone):
    return delta_txt
 
 
+# Reservoir image level for remaining units above threshold
+RESERVOIR_LEVELS = ((150, 200), # green
+                    (80,  150), # yellow
+                    (1,   50))  # red
+
 def reservoir_level(lvl):
-   if lvl > 150:
-      img_lvl = 200  # green
-   elif lvl > 80:
-      img_lvl = 150  # yellow
-   elif lvl > 1:
-      img_lvl = 50   # red
-   else:
-      img_lvl = 0    # empty 
-   return img_lvl
+   for threshold,img_lvl in RESERVOIR_LEVELS:
+      if lvl > threshold:
+         return img_lvl
+   return 0 # empty
 
 
 def time_to_calib_progress(ttc,sst,cst):
@@ -375,18 +461,11 @@ def sensor_age_icon(rem_hours, sensor_state):
 def convert_datetimestr_to_epoch(datetimestr):
    # datetime string format is the following:
    # yyyy-mm-ddThh:mm:ss.000-00:00
+   # (only the date and time part is parsed, the offset is ignored)
    try:
-      d  = datetimestr.split('.')[0].split('T')[0]
-      t  = datetimestr.split('.')[0].split('T')[1]
-      year = int(d.split('-')[0])
-      mon  = int(d.split('-')[1])
-      day  = int(d.split('-')[2])
-      hour = int(t.split(':')[0])
-      min  = int(t.split(':')[1])
-      sec  = int(t.split(':')[2])
-      #print("%d-%d-%d %d:%d:%d"%(year,mon,day,hour,min,sec))
-      return time.mktime((year,mon,day,hour,min,sec,0,0,dstDelta))
-   except:
+      tm = datetime.datetime.fromisoformat(datetimestr[:19]).timetuple()
+      return time.mktime(tm[:8]+(dstDelta,))
+   except (TypeError, ValueError, OverflowError):
       return 0
 
 
@@ -400,6 +479,9 @@ def handle_alarm(lastAlarm):
       lastAlarmMsg.delete() 
       lastAlarmMsg = None
 
+   if not lastAlarm:
+      return
+
    try:
       # Check for new alarm
       if lastAlarmId != lastAlarm["instanceId"]:
@@ -420,7 +502,7 @@ def handle_alarm(lastAlarm):
                sndfile = "res/sound_alert.wav"
             speaker.playWAV(sndfile, rate=22000)
          lastAlarmId = lastAlarm["instanceId"]
-   except:
+   except (KeyError, TypeError, AttributeError):
       pass
         
 
@@ -431,115 +513,184 @@ def handle_alarm(lastAlarm):
 #################################################
 
 def ttimer0():
-   global runNtpsync
-   runNtpsync = True
+   global ntp
+   ntp = handle_ntpsync(ntpserver, timezone)
 
 def handle_ntpsync(ntpserver, timezone):
    # Periodic timer: sync time via NTP
    try:
       ntp = ntpclient(host=ntpserver, timezone=int(timezone)+dstDelta)
-   except:
+   except ValueError:
       ntp = None
    return ntp
 
 
 def ttimer1():
-   global runTimeupdate
-   runTimeupdate = True
-
-def handle_timeupdate(ntp, timezone):
-   try:
-      # Update display time
-      time = ("%02d:%02d") % (ntp.hour(),ntp.minute())
-      labelTime.set_text(time)
-      align_text(labelTime,"right",0)
-      labelLastData.set_text(time_delta(lastUpdateTm,ntp,timezone))
-      align_text(labelLastData,"center",218)
-   except:
-      pass
+   handle_timeupdate(ntp, tzHours)
+
+def handle_timeupdate(ntp, tzhours):
+   if ntp == None:
+      return
+   # Update display time
+   now = ntp.now()
+   time = ("%02d:%02d") % now
+   labelTime.set_text(time)
+   align_text(labelTime,"right",0)
+   labelLastData.set_text(time_delta(lastUpdateTm,now,tzhours))
+   align_text(labelLastData,"center",218)
+
+
+def pumpdata_worker(proxyaddr, proxyport, period, maxperiod):
+   # Network thread: get Minimed data periodically and pass it
+   # to the main thread which does all the screen updates.
+   # The main thread is woken up with a <<PumpData>> event
+   # (if that fails, the fallback timer picks up the data).
+   # While the data on the proxy does not change, the poll period
+   # is increased step by step up to maxperiod.
+   lastServerTime = None
+   headers = {}
+   delay = period
+   while True:
+      status, data = get_pumpdata(proxyaddr, proxyport, headers)
+      if status == 304:
+         # Not modified, nothing to update
+         serverTime = lastServerTime
+      else:
+         try:
+            pumpdataQueue.put_nowait(data)
+         except queue.Full:
+            pass
+         try:
+            s.window.event_generate("<<PumpData>>", when="tail")
+         except (RuntimeError, TclError) as e:
+            if windowClosed:
+               return
+            # Tk not ready or without thread support, keep polling
+            print("Failed to signal pump data: %s" % (e))
+         serverTime = data.get("lastConduitUpdateServerTime") if isinstance(data, dict) else None
+      if serverTime != None and serverTime == lastServerTime:
+         delay = min(delay+period, maxperiod)
+      else:
+         delay = period
+      lastServerTime = serverTime
+      time.sleep(delay)
 
+def get_pumpdata(proxyaddr, proxyport, headers):
+   proxy_url = "http://%s:%s/%s" % (proxyaddr, proxyport, API_URL)
 
-def ttimer2():
-   global runPumpdataupdate
-   runPumpdataupdate = True
+   # Get Minimed data from proxy via API
+   # (the session reuses the proxy connection and bounds the request time)
+   # The headers hold the conditional request fields from the last
+   # response, so the proxy can answer with 304 if nothing changed.
+   try:
+      r = httpSession.get(proxy_url, headers=headers, timeout=HTTP_TIMEOUT_S)
+   except OSError:
+      return None, None
+   
+   # Parse response body once
+   data = None
+   if r.status_code == 200:
+      try:
+         data = r.json()
+      except ValueError:
+         data = None
+      headers.clear()
+      if "ETag" in r.headers:
+         headers["If-None-Match"] = r.headers["ETag"]
+      if "Last-Modified" in r.headers:
+         headers["If-Modified-Since"] = r.headers["Last-Modified"]
+      elif isinstance(data, dict) and "lastConduitUpdateServerTime" in data:
+         headers["If-Modified-Since"] = email.utils.formatdate(data["lastConduitUpdateServerTime"]/1000, usegmt=True)
+   return r.status_code, data
+
+
+def pumpdata_event(event=None):
+   # Pump data received from network thread
+   while True:
+      try:
+         data = pumpdataQueue.get_nowait()
+      except queue.Empty:
+         return
+      handle_pumpdataupdate(data)
 
-def handle_pumpdataupdate(proxyaddr, proxyport):
+def handle_pumpdataupdate(data):
    global lastErrorMsg
    global lastUpdateTm
    global dstDelta
-   proxy_url = "http://%s:%s/%s" % (proxyaddr, proxyport, API_URL)
 
    # Update Minimed data
    
-   # Get Minimed data from proxy via API
-   # (urequests does not handle timeouts so we do this with an external timer)
-   #timerSch.run('timer5', TIMER5_PERIOD_S*1000, 0x01)
-   try:
-      r = urequests.request(method='GET', url=proxy_url, headers={})
-   except OSError:
-      r = None
-   #timerSch.stop('timer5')
    if lastErrorMsg != None:
       lastErrorMsg.delete()
       lastErrorMsg = None
    
-   if r != None and r.status_code == 200 and r.json() != "":
+   # (anything but a dict is not valid pump data)
+   if isinstance(data, dict):
       try:
-         lastUpdateTm = time.localtime(int(r.json()["lastConduitUpdateServerTime"]/1000))
+         lastUpdateTm = time.localtime(int(data["lastConduitUpdateServerTime"]/1000))
          
          # Check for DST
-         dstDelta = 1 if r.json()["clientTimeZoneName"].lower().find("summer")>-1 else 0
+         tzName = data["clientTimeZoneName"].lower()
+         dstDelta = 1 if "summer" in tzName or "daylight" in tzName else 0
          
          # Check for alarm notification
-         handle_alarm(r.json()["lastAlarm"])
+         handle_alarm(data.get("lastAlarm"))
          
          # Check conduit, medical device in range
-         haveData = r.json()["conduitInRange"] and r.json()["conduitMedicalDeviceInRange"]
+         haveData = data["conduitInRange"] and data["conduitMedicalDeviceInRange"]
 
          ##### Screen 1 #####
          
          if haveData:
-            imageBattery.set_img_src("res/mm_batt"+str(r.json()["medicalDeviceBatteryLevelPercent"])+".png")
-            imageReservoir.set_img_src("res/mm_tank"+str(reservoir_level(r.json()["reservoirRemainingUnits"]))+".png")
-            imageSage.set_img_src("res/mm_sage_"+sensor_age_icon(r.json()["sensorDurationHours"],r.json()["sensorState"])+".png")
-            labelSage.set_text(sensor_age_text(r.json()["sensorDurationHours"]))
+            imageBattery.set_img_src(IMG_BATTERY.get(data["medicalDeviceBatteryLevelPercent"],"res/mm_batt_unk.png"))
+            imageReservoir.set_img_src(IMG_RESERVOIR[reservoir_level(data["reservoirRemainingUnits"])])
+            imageSage.set_img_src(IMG_SAGE[sensor_age_icon(data["sensorDurationHours"],data["sensorState"])])
+            labelSage.set_text(sensor_age_text(data["sensorDurationHours"]))
          else:
             imageBattery.set_img_src("res/mm_batt_unk.png")
             imageReservoir.set_img_src("res/mm_tank_unk.png")
             imageSage.set_img_src("res/mm_sage_unk.png")
             labelSage.set_text("")
          
-         if r.json()["conduitSensorInRange"]:
+         if data["conduitSensorInRange"]:
             imageSensorConn.set_img_src("res/mm_sensor_connection_ok.png")
          else:
             imageSensorConn.set_img_src("res/mm_sensor_connection_nok.png")
          
-         time_to_calib_progress(r.json()["timeToNextCalibHours"],r.json()["sensorState"],r.json()["calibStatus"])
+         time_to_calib_progress(data["timeToNextCalibHours"],data["sensorState"],data["calibStatus"])
          
-         if not haveData or r.json()["therapyAlgorithmState"]["autoModeShieldState"] == "FEATURE_OFF":
+         if not haveData or data["therapyAlgorithmState"]["autoModeShieldState"] == "FEATURE_OFF":
             imageShield.set_hidden(True)
          else:
-            imageShield.set_img_src("res/mm_shield_"+r.json()["lastSGTrend"].lower()+".png")
+            imageShield.set_img_src(f"res/mm_shield_{data['lastSGTrend'].lower()}.png")
             imageShield.set_hidden(False)
-         lastSG = r.json()["lastSG"]["sg"]
+         lastSG = data["lastSG"]["sg"]
          #print("lastSG: "+str(lastSG))
          labelBglValue.set_text(str(lastSG) if lastSG > 0 else "--")
-         align_text(labelBglValue,"center",95)
          
          if haveData:
-            labelActInsValue.set_text(str(r.json()["activeInsulin"]["amount"])+" U")
+            labelActInsValue.set_text(f"{data['activeInsulin']['amount']} U")
          else:
             labelActInsValue.set_text("-- U")
-         align_text(labelActInsValue,"right",173)
-      except:
+      except (KeyError, TypeError, AttributeError, ValueError, OverflowError, OSError, TclError):
          pass
       
+      # No banner shown if pump banner list is empty
       try:
-         pumpBanner = r.json()["pumpBannerState"][0]["type"]
-         imageBanner.set_img_src("res/mm_banner_"+pumpBanner.lower()+".png")
-         imageBanner.set_hidden(False)
-      except:
+         pumpBanner = data.get("pumpBannerState")
+         if pumpBanner:
+            imageBanner.set_img_src(f"res/mm_banner_{pumpBanner[0]['type'].lower()}.png")
+            imageBanner.set_hidden(False)
+         else:
+            imageBanner.set_hidden(True)
+      except (KeyError, TypeError, AttributeError, ValueError, OverflowError, OSError, TclError):
          imageBanner.set_hidden(True)
+      
+      # Align labels once all texts are set (measures the text bounds)
+      # and redraw the canvas in one go
+      align_text(labelBglValue,"center",95)
+      align_text(labelActInsValue,"right",173)
+      scr1.update_idletasks()
 
 #################################################
 #
@@ -576,9 +727,19 @@ TIMER1_PERIOD_S = 10
 timerSch.run(ttimer1, TIMER1_PERIOD_S*1000, 0x00)
 
 # Timer 2: 60 sec (periodic) // pumpdataupdate
+# (runs in the network thread which passes the received
+# data to the main thread via queue and <<PumpData>> event)
+# Slows down to 300 sec while pump data is unchanged
 TIMER2_PERIOD_S = 60
-#timerSch.run('timer2', TIMER2_PERIOD_S*1000, 0x00)
-timerSch.run(ttimer2, TIMER2_PERIOD_S*1000, 0x00)
+TIMER2_MAX_PERIOD_S = 300
+pumpdataQueue = queue.Queue(maxsize=2)
+s.window.bind("<<PumpData>>", pumpdata_event)
+pumpdataThread = threading.Thread(target=pumpdata_worker, args=(proxyaddr, proxyport, TIMER2_PERIOD_S, TIMER2_MAX_PERIOD_S), daemon=True)
+# Start network thread as soon as the Tk event loop is running
+timerSch.run(pumpdataThread.start, 0, 0x01)
+# Fallback in case the <<PumpData>> event cannot be sent
+PUMPDATA_QUEUE_PERIOD_S = 1
+timerSch.run(pumpdata_event, PUMPDATA_QUEUE_PERIOD_S*1000, 0x00)
 
 # Timer 3: 0.2 sec (periodic) // touchevent
 TIMER3_PERIOD_S = 0.2
@@ -593,7 +754,13 @@ TIMER5_PERIOD_S = 60
 # Run some timer functions immediately to init
 ttimer0()
 ttimer1()
-ttimer2()
+
+# Stop the network thread when the window is closed
+def window_closed():
+   global windowClosed
+   windowClosed = True
+   s.window.destroy()
+s.window.protocol("WM_DELETE_WINDOW", window_closed)
 
 
 #################################################
@@ -601,23 +768,8 @@ ttimer2()
 # Main loop
 #
 #################################################
-while True:
-   # Run handlers as requested
-   if runPumpdataupdate:
-      handle_pumpdataupdate(proxyaddr, proxyport)
-      runPumpdataupdate = False
-   if runNtpsync:
-      ntp = handle_ntpsync(ntpserver, timezone)
-      runNtpsync = False
-   if runTimeupdate:
-      handle_timeupdate(ntp, timezone)
-      runTimeupdate = False
-   
-   wait_ms(100)
-
-   try:
-      s.window.update()
-   except:
-      break
+# Hand over to the Tk event loop which runs the timers
+# and sleeps in between (returns when the window is closed)
+s.window.mainloop()
 
 print("Exiting")
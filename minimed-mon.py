@@ -63,37 +63,86 @@ from m5stack_ui import *
 from uiflow import *
 import ntptime
 import time
-import urequests
+import json
 import nvs
 import network
 import socket
 import machine
+import lvgl as lv
+import gc
+import micropython
+from micropython import const
 
 VERSION = "0.8"
 
 # Contants
-NTPCONST = 946681200 # seconds from 01/01/1970 to 01/01/2000
+NTPCONST = const(946681200) # seconds from 01/01/1970 to 01/01/2000
+CGM_PERIOD_S = const(300)   # new sensor data every 5 min
+ALARM_MAX_AGE_S = const(900) # alarms older than 15 min are not shown
 
 # Default configuration parameters
 DEFAULT_NTP_SERVER = "pool.ntp.org"
 DEFAULT_TIME_ZONE  = "1"
 DEFAULT_PROXY_PORT = "8081"
 
+# Carelink proxy parameters
+API_URL        = "carelink/nohistory"
+HTTP_TIMEOUT_S = const(10) # socket timeout for proxy requests
+
 # Access point parameters
-API_URL     = "carelink/nohistory"
 AP_SSID     = "M5_MINIMED_MON"
 AP_ADDR     = "192.168.4.1"
+AP_TIMEOUT_S = const(5) # socket timeout for web GUI clients
+
+# Calibration arc geometry
+CALIB_ARC_X     = const(112)
+CALIB_ARC_Y     = const(17)
+CALIB_ARC_R     = const(16)
+CALIB_ARC_THICK = const(4)
+CALIB_ARC_END   = const(359)
+
+# Calibration states: drop image, drop position, circle color, decreasing circle
+CALIB_STATES = {
+   "unknown":  ("res/mm_drop_unk.png",  106,8,0x00cccc,False), # full blue circle, question mark
+   "full":     ("res/mm_drop_white.png",105,8,0x33cc00,False), # full green circle, white drop
+   "green":    ("res/mm_drop_white.png",105,8,0x33cc00,True),  # decreasing green circle, white drop
+   "red":      ("res/mm_drop_white.png",105,8,0xff0000,True),  # decreasing red circle, white drop
+   "required": ("res/mm_drop_red.png",  100,0,0x000000,False), # no circle, red drop
+   "none":     ("res/mm_drop_white.png",105,8,0x000000,False), # no circle, white drop
+}
+
+# Image files
+IMG_BATTERY   = {lvl: "res/mm_batt%d.png" % lvl for lvl in (0,25,50,75,100)}
+IMG_RESERVOIR = {lvl: "res/mm_tank%d.png" % lvl for lvl in (0,50,150,200)}
+IMG_SAGE      = {icon: "res/mm_sage_%s.png" % icon for icon in ("expired","unk","green","red")}
+IMG_SHIELD    = {trend.upper(): "res/mm_shield_%s.png" % trend for trend in ("none","up","up_double","up_triple","down","down_double","down_triple")}
+IMG_BANNER    = {banner.upper(): "res/mm_banner_%s.png" % banner for banner in ("bg_required","delivery_suspend","suspended_on_low","temp_target")}
+IMG_CACHE_SIZE = const(8) # images on screen 1 + 1
 
 # Gobal variables
+httpConn     = None
 dstDelta     = 0
 lastUpdateTm = time.localtime(0)
 lastAlarmId  = 0
 lastAlarmMsg = None
 lastErrorMsg = None
 lastApMsg    = None
-runNtpsync        = False
-runTimeupdate     = False
-runPumpdataupdate = False
+uiCache      = {}
+activeScr    = None
+scr2Pending  = {}
+calibProgress = None
+calibRedraw   = False
+calibArc      = None
+alarmTexts    = {}
+lastTouch     = False
+screenBright  = False
+ntpTz         = None
+lastConduitTs = None
+lastTzName    = None
+pollPeriod    = None
+pollRetry     = False
+lastContent   = None
+lastEtag      = None
 
 
 #################################################
@@ -102,65 +151,99 @@ runPumpdataupdate = False
 #
 #################################################
 
+# Web pages (built once, the config page is a template for the current parameters)
+HTTP_HEADER = b'HTTP/1.1 200 OK\nContent-Type: text/html\nConnection: close\n\n'
+
+HTML_CONFIG = ('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">\n'
+               '<html><head><title>M5 Minimed Mon</title></head>\n'
+               '<body><table style="text-align: left; width: 400px; background-color: #2196F3; font-family: Helvetica,Arial,sans-serif; font-weight: bold; color: white;" border="0" cellpadding="2" cellspacing="2">\n'
+               '<tbody><tr><td>\n'
+               '<span style="vertical-align: top; font-size: 48px;">M5 Minimed Mon</span><br>\n'
+               '<span style="font-size: 20px; color: rgb(204, 255, 255);">Configuration</span>\n'
+               '</td></tr></tbody></table><br>\n'
+               '<form action="/m5config">\n'
+               '<table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody>\n'
+               '<tr style="font-size: 18px; background-color: lightgrey">\n'
+               '<td style="width: 200px;">Wifi parameters</td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">SSID<br><input type="text" id="fwifissid" name="fwifissid"></td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">Password<br><input type="text" id="fwifipass" name="fwifipass"></td>\n'
+               '</tbody></table><br>\n'
+               '<table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody>\n'
+               '<tr style="font-size: 18px; background-color: lightgrey">\n'
+               '<td style="width: 200px;">Time and date</td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">NTP server address<br><input type="text" id="fntpserver" name="fntpserver" value=%s></td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">Time Zone (h)<br><input type="text" id="ftimezone" name="ftimezone" value=%s></td>\n'
+               '</tbody></table><br>\n'
+               '<table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody>\n'
+               '<tr style="font-size: 18px; background-color: lightgrey">\n'
+               '<td style="width: 200px;">Carelink proxy</td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">IP address<br><input type="text" id="fproxyaddr" name="fproxyaddr"></td>\n'
+               '<tr style="vertical-align: top; background-color: rgb(230, 230, 255);">\n'
+               '<td style="width: 300px;">Port<br><input type="text" id="fproxyport" name="fproxyport" value=%s></td>\n'
+               '</tbody></table><br>\n'
+               '<input type="submit" value="Save">\n'
+               '</form></body></html>\n')
+
+HTML_SUCCESS = (b'<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">\n'
+                b'<html><head><title>M5 Minimed Mon</title></head>\n'
+                b'<body><table style="text-align: left; width: 400px; background-color: #2196F3; font-family: Helvetica,Arial,sans-serif; font-weight: bold; color: white;" border="0" cellpadding="2" cellspacing="2">\n'
+                b'<tbody><tr><td>\n'
+                b'<span style="vertical-align: top; font-size: 48px;">M5 Minimed Mon</span><br>\n'
+                b'<span style="font-size: 20px; color: rgb(204, 255, 255);">Configuration</span>\n'
+                b'</td></tr></tbody></table><br>\n'
+                b'<table style="text-align: left; width: 400px; background-color: rgb(230, 230, 255); font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody>\n'
+                b'<tr><td style="color: green; font-size: 18px;">Parameters updated successfully</td>\n'
+                b'<tr><td style="color: grey">Restarting device with new configuration ...</td>\n'
+                b'</tbody></table></body></html>\n')
+
+
 def web_page_config(ntpserver,timezone,proxyport):
-   html =  '<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd"> \n \
-            <html><head><title>M5 Minimed Mon</title></head> \n \
-            <body><table style="text-align: left; width: 400px; background-color: #2196F3; font-family: Helvetica,Arial,sans-serif; font-weight: bold; color: white;" border="0" cellpadding="2" cellspacing="2"> \n \
-            <tbody><tr><td> \n \
-            <span style="vertical-align: top; font-size: 48px;">M5 Minimed Mon</span><br> \n \
-            <span style="font-size: 20px; color: rgb(204, 255, 255);">Configuration</span> \n \
-            </td></tr></tbody></table><br> \n \
-            <form action="/m5config"> \n \
-            <table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody> \n \
-            <tr style="font-size: 18px; background-color: lightgrey"> \n \
-            <td style="width: 200px;">Wifi parameters</td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">SSID<br><input type="text" id="fwifissid" name="fwifissid"></td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">Password<br><input type="text" id="fwifipass" name="fwifipass"></td> \n \
-            </tbody></table><br> \n \
-            <table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody> \n \
-            <tr style="font-size: 18px; background-color: lightgrey"> \n \
-            <td style="width: 200px;">Time and date</td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">NTP server address<br><input type="text" id="fntpserver" name="fntpserver" value=%s></td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">Time Zone (h)<br><input type="text" id="ftimezone" name="ftimezone" value=%s></td> \n \
-            </tbody></table><br> \n \
-            <table style="text-align: left; width: 400px; background-color: white; font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody> \n \
-            <tr style="font-size: 18px; background-color: lightgrey"> \n \
-            <td style="width: 200px;">Carelink proxy</td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">IP address<br><input type="text" id="fproxyaddr" name="fproxyaddr"></td> \n \
-            <tr style="vertical-align: top; background-color: rgb(230, 230, 255);"> \n \
-            <td style="width: 300px;">Port<br><input type="text" id="fproxyport" name="fproxyport" value=%s></td> \n \
-            </tbody></table><br> \n \
-            <input type="submit" value="Save"> \n \
-            </form></body></html>' % (ntpserver,timezone,proxyport)
-   return html
+   return HTML_CONFIG % (ntpserver,timezone,proxyport)
 
 
 def web_page_success():
-   html =  '<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd"> \n \
-            <html><head><title>M5 Minimed Mon</title></head> \n \
-            <body><table style="text-align: left; width: 400px; background-color: #2196F3; font-family: Helvetica,Arial,sans-serif; font-weight: bold; color: white;" border="0" cellpadding="2" cellspacing="2"> \n \
-            <tbody><tr><td> \n \
-            <span style="vertical-align: top; font-size: 48px;">M5 Minimed Mon</span><br> \n \
-            <span style="font-size: 20px; color: rgb(204, 255, 255);">Configuration</span> \n \
-            </td></tr></tbody></table><br> \n \
-            <table style="text-align: left; width: 400px; background-color: rgb(230, 230, 255); font-family: Helvetica,Arial,sans-serif; font-weight: bold; font-size: 14px;" border="0" cellpadding="2" cellspacing="3"><tbody> \n \
-            <tr><td style="color: green; font-size: 18px;">Parameters updated successfully</td> \n \
-            <tr><td style="color: grey">Restarting device with new configuration ...</td> \n \
-            </tbody></table></body></html>'
-   return html
-
-
-def get_url_param(url,param):
+   return HTML_SUCCESS
+
+
+def url_decode(value):
+   # Decode "+" and %xx escapes in URL parameter value
+   value = value.replace("+"," ")
+   if "%" not in value:
+      return value
+   parts = value.split("%")
+   res = bytearray(parts[0].encode())
+   for part in parts[1:]:
+      try:
+         if len(part) < 2:
+            raise ValueError
+         res.append(int(part[:2],16))
+         res.extend(part[2:].encode())
+      except ValueError:
+         res.extend(("%"+part).encode())
    try:
-      value = url.split("?")[1].split(param+"=")[1].split("&")[0]
+      return bytes(res).decode()
+   except UnicodeError:
+      # Not valid UTF-8, keep the value undecoded
+      return value
+
+
+def get_url_params(url):
+   # Parse all URL parameters at once into a dict
+   params = {}
+   try:
+      query = url.split("?",1)[1]
    except IndexError:
-      value = None
-   return value
+      return params
+   for param in query.split("&"):
+      kv = param.split("=",1)
+      if len(kv) == 2:
+         params[kv[0]] = url_decode(kv[1])
+   return params
 
 
 def do_ap_msg(msg):
@@ -186,44 +269,45 @@ def do_access_point(ntpserver,timezone,proxyport):
    
    # Wait for client to connect
    while ap.isconnected() == False:
-       pass
+       wait_ms(200)
    do_ap_msg("WIFI connection established\nLoad address %s in web browser" % (AP_ADDR))
    
    # Get WIFI credentials via Web GUI
    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
    s.bind((AP_ADDR, 80))
    s.listen(5)
    
    while True:
       # Get request
       conn,addr = s.accept()
-      request = str(conn.recv(1024))
-      rmethod  = request.split()[0]
-      rurl     = request.split()[1]
-      rheaders = request.split()[2]
+      # (don't let a client which sends nothing block the device)
+      conn.settimeout(AP_TIMEOUT_S)
+      # Parse only the request line
+      try:
+         request = conn.recv(1024)
+         rmethod,rurl,rheaders = request.split(b"\r\n",1)[0].decode().split(None,2)
+      except (OSError, ValueError, UnicodeError):
+         conn.close()
+         continue
       print("request: %s\n" % (request))
       #print("rmethod: %s\n" % (rmethod))
       print("rurl: %s\n" % (rurl))
       
       # Send response headers
-      conn.send('HTTP/1.1 200 OK\n')
-      conn.send('Content-Type: text/html\n')
-      conn.send('Connection: close\n\n')
+      conn.send(HTTP_HEADER)
 
       if rurl.find("/m5config") != -1:
          # Get input parameters from request
-         wifissid  = get_url_param(rurl, "fwifissid")
-         wifipass  = get_url_param(rurl, "fwifipass")
-         ntpserver = get_url_param(rurl, "fntpserver")
-         timezone  = get_url_param(rurl, "ftimezone")
-         proxyaddr = get_url_param(rurl, "fproxyaddr")
-         proxyport = get_url_param(rurl, "fproxyport")
-         if wifissid  != None and wifissid  != "" and \
-            wifipass  != None and wifipass  != "" and \
-            ntpserver != None and ntpserver != "" and \
-            timezone  != None and timezone  != "" and \
-            proxyaddr != None and proxyaddr != "" and \
-            proxyport != None and proxyport != "":
+         params    = get_url_params(rurl)
+         wifissid  = params.get("fwifissid")
+         wifipass  = params.get("fwifipass")
+         ntpserver = params.get("fntpserver")
+         timezone  = params.get("ftimezone")
+         proxyaddr = params.get("fproxyaddr")
+         proxyport = params.get("fproxyport")
+         # (all parameters must be present and not empty)
+         if all((wifissid,wifipass,ntpserver,timezone,proxyaddr,proxyport)):
             
             print("New configuration parameters received\n")
             # Send reboot page
@@ -236,24 +320,21 @@ def do_access_point(ntpserver,timezone,proxyport):
       conn.close()
             
    # Write WIFI credentials to EEPROM
-   nvs.write_str('wifissid',  wifissid) 
-   wait_ms(100)
-   nvs.write_str('wifipass',  wifipass)
-   wait_ms(100)
-   nvs.write_str('ntpserver', ntpserver)
-   wait_ms(100)
-   nvs.write_str('timezone',  timezone)
-   wait_ms(100)
-   nvs.write_str('proxyaddr', proxyaddr)
-   wait_ms(100)
-   nvs.write_str('proxyport', proxyport)
-   wait_ms(100)
+   # (each write is committed right away, no need to wait)
+   for key,value in (('wifissid',  wifissid),
+                     ('wifipass',  wifipass),
+                     ('ntpserver', ntpserver),
+                     ('timezone',  timezone),
+                     ('proxyaddr', proxyaddr),
+                     ('proxyport', proxyport)):
+      nvs.write_str(key, value)
    print("New configuration parameters stored in EEPROM\n")
    print("wifissid: %s, wifipass: %s, proxyaddr: %s, proxyport: %s, ntpserver: %s, timezone: %s\n" % (wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone))
    do_ap_msg("New configuration parameters stored in EEPROM\nResetting device ...")
 
    # Reset device
-   wait_ms(8000)
+   # (leave enough time to read the message)
+   wait_ms(3000)
    machine.reset()
 
 
@@ -283,13 +364,15 @@ def read_config():
    # To delete a key/value pair use the following command
    # nvs.esp32.nvs_erase(<key>)
 
+   return (wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone)
+
+
+def check_config(wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone):
    if wifissid == None or wifipass == None or proxyaddr == None:
       print("Needed configuration parameters not found in EEPROM\n")
       # Start access point for configuration
       do_access_point(ntpserver,timezone,proxyport)
 
-   return (wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone)
-
 
 #################################################
 #
@@ -297,16 +380,23 @@ def read_config():
 #
 #################################################
 
-def wlan_connect(wifissid, wifipass, ntpserver, timezone, proxyport):
-   # Try to connect to WIFI network
+def wlan_start(wifissid, wifipass):
+   # Start connecting to WIFI network (doesn't wait for the connection)
    wlan = network.WLAN(network.STA_IF)
    wlan.active(True)
-   wlan.connect(wifissid, wifipass)
+   if wifissid != None and wifipass != None:
+      wlan.connect(wifissid, wifipass)
+   return wlan
+
+
+def wlan_connect(wlan, wifissid, ntpserver, timezone, proxyport):
+   # Wait for connection to WIFI network
+   # (check often so we can continue as soon as we are connected)
    ctimeout=0
    while not wlan.isconnected():
-      wait_ms(1000)
+      wait_ms(250)
       ctimeout += 1
-      if ctimeout > 5:
+      if ctimeout > 23:
          break
    if not wlan.isconnected():
       wlan.active(False)
@@ -315,12 +405,114 @@ def wlan_connect(wifissid, wifipass, ntpserver, timezone, proxyport):
       do_access_point(ntpserver,timezone,proxyport)
 
 
+#################################################
+#
+# HTTP client functions
+#
+#################################################
+
+class HttpResponse:
+   # Minimal replacement of the urequests response object
+   def __init__(self, status_code, content, etag=None):
+      self.status_code = status_code
+      self.content = content
+      self.etag = etag
+   def json(self):
+      return json.loads(self.content)
+   def close(self):
+      self.content = None
+
+
+def http_close():
+   global httpConn
+   if httpConn != None:
+      try:
+         httpConn.close()
+      except OSError:
+         pass
+      httpConn = None
+
+
+def http_get(host, port, path, etag=None):
+   # HTTP/1.1 GET request which keeps the connection open for the
+   # next request if the server allows it (keep-alive). A broken
+   # kept-alive connection is reopened once. With the ETag of the
+   # last response the server can answer 304 if nothing changed.
+   # Note: chunked transfer encoding is not supported.
+   global httpConn
+   while True:
+      reused = httpConn != None
+      try:
+         if httpConn == None:
+            addr = socket.getaddrinfo(host, int(port))[0][-1]
+            httpConn = socket.socket()
+            httpConn.settimeout(HTTP_TIMEOUT_S)
+            httpConn.connect(addr)
+         request = "GET /%s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\nAccept: application/json\r\n" % (path, host)
+         if etag != None:
+            request += "If-None-Match: %s\r\n" % etag
+         httpConn.write((request + "\r\n").encode())
+         
+         # Status line
+         line = httpConn.readline()
+         if not line:
+            raise OSError("connection closed")
+         status = int(line.split(None, 2)[1])
+         keepalive = line.startswith(b"HTTP/1.1")
+         
+         # Headers
+         length = None
+         respEtag = None
+         while True:
+            line = httpConn.readline()
+            if not line or line == b"\r\n":
+               break
+            hdr = line.decode().split(":", 1)
+            if len(hdr) == 2:
+               name = hdr[0].strip().lower()
+               if name == "content-length":
+                  length = int(hdr[1])
+               elif name == "connection":
+                  keepalive = hdr[1].strip().lower() == "keep-alive"
+               elif name == "etag":
+                  respEtag = hdr[1].strip()
+         
+         # Body
+         # (a 304 response never has one)
+         if status == 304:
+            content = b""
+         elif length != None:
+            content = b""
+            while len(content) < length:
+               chunk = httpConn.read(length-len(content))
+               if not chunk:
+                  raise OSError("connection closed")
+               content += chunk
+         else:
+            content = httpConn.read()
+            keepalive = False
+         if not keepalive:
+            http_close()
+         return HttpResponse(status, content, respEtag)
+      except (OSError, ValueError, IndexError):
+         http_close()
+         if not reused:
+            raise OSError("HTTP request failed")
+
+
 # Startup message
 lcd.clear()
 lcd.font(lcd.FONT_DejaVu24)
 lcd.setTextColor(lcd.WHITE)
 lcd.println("Minimed Mon, ver %s" % (VERSION))
 print("Minimed Mon, ver %s" % (VERSION))
+
+# Read config from EEPROM
+wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone = read_config()
+print("wifissid: %s, wifipass: %s, proxyaddr: %s, proxyport: %s, ntpserver: %s, timezone: %s\n" % (wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone))
+
+# Connect to WIFI network while the startup message is shown
+wlan = wlan_start(wifissid, wifipass)
 wait_ms(3000)
 
 # Init screen
@@ -329,33 +521,46 @@ screen.clean_screen()
 screen.set_screen_bg_color(0x000000)
 screen.set_screen_brightness(40)
 
-# Read config from EEPROM
-wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone = read_config()
-print("wifissid: %s, wifipass: %s, proxyaddr: %s, proxyport: %s, ntpserver: %s, timezone: %s\n" % (wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone))
+# Start access point if configuration is incomplete
+check_config(wifissid,wifipass,proxyaddr,proxyport,ntpserver,timezone)
 
 # Connect to network
-wlan_connect(wifissid, wifipass, ntpserver, timezone, proxyport)
+wlan_connect(wlan, wifissid, ntpserver, timezone, proxyport)
 
 # Create screen 1
 scr1 = None
+activeScr = scr1
+
+# Keep all decoded images of screen 1 in the LVGL image cache
+# (otherwise an image is read from flash and decoded again on every redraw)
+try:
+   lv.img.cache_set_size(IMG_CACHE_SIZE)
+except:
+   pass
 
 # Load images on screen 1
-imageBattery     = M5Img("res/mm_batt_unk.png", x=6, y=0, parent=scr1)
-imageReservoir   = M5Img("res/mm_tank_unk.png", x=40, y=0, parent=scr1)
-imageSensorConn  = M5Img("res/mm_sensor_connection_nok.png", x=68, y=0, parent=scr1)
-imageDrop        = M5Img("res/mm_drop_unk.png", x=105, y=8, parent=scr1)
-imageSage        = M5Img("res/mm_sage_unk.png", x=135, y=0, parent=scr1)
-imageShield      = M5Img("res/mm_shield_none.png", x=65, y=33, parent=scr1)
-imageBanner      = M5Img("res/mm_banner_delivery_suspend.png", x=40, y=145, parent=scr1)
+# (image, x, y)
+IMG_DEFS = (("res/mm_batt_unk.png",6,0),
+            ("res/mm_tank_unk.png",40,0),
+            ("res/mm_sensor_connection_nok.png",68,0),
+            ("res/mm_drop_unk.png",105,8),
+            ("res/mm_sage_unk.png",135,0),
+            ("res/mm_shield_none.png",65,33),
+            ("res/mm_banner_delivery_suspend.png",40,145))
+imageBattery,imageReservoir,imageSensorConn,imageDrop,imageSage,imageShield,imageBanner = \
+   [M5Img(img, x=x, y=y, parent=scr1) for img,x,y in IMG_DEFS]
 
 # Init labels on screen 1
-labelBglValue    = M5Label('--', x=140, y=90, color=0xffffff, font=FONT_MONT_48, parent=scr1)
-labelBglUnit     = M5Label('mg/dL', x=137, y=145, color=0x89abeb, font=FONT_MONT_16, parent=scr1)
-labelActInsValue = M5Label('-- U', x=261, y=173, color=0xffffff, font=FONT_MONT_26, parent=scr1)
-labelActIns      = M5Label('Act Insulin', x=231, y=200, color=0xffffff, font=FONT_MONT_16, parent=scr1)
-labelTime        = M5Label('--:--', x=250, y=0, color=0xffffff, font=FONT_MONT_28, parent=scr1)
-labelLastData    = M5Label('--', x=120, y=218, color=0xffffff, font=FONT_MONT_20, parent=scr1)
-labelSage        = M5Label('', x=144, y=8, color=0xffffff, font=FONT_MONT_14, parent=scr1)
+# (text, x, y, color, font)
+LABEL_DEFS_SCR1 = (('--',140,90,0xffffff,FONT_MONT_48),
+                   ('mg/dL',137,145,0x89abeb,FONT_MONT_16),
+                   ('-- U',261,173,0xffffff,FONT_MONT_26),
+                   ('Act Insulin',231,200,0xffffff,FONT_MONT_16),
+                   ('--:--',250,0,0xffffff,FONT_MONT_28),
+                   ('--',120,218,0xffffff,FONT_MONT_20),
+                   ('',144,8,0xffffff,FONT_MONT_14))
+labelBglValue,labelBglUnit,labelActInsValue,labelActIns,labelTime,labelLastData,labelSage = \
+   [M5Label(text, x=x, y=y, color=color, font=font, parent=scr1) for text,x,y,color,font in LABEL_DEFS_SCR1]
 
 # Create screen 2
 scr2 = screen.get_new_screen()
@@ -363,15 +568,19 @@ screen.clean_screen(scr2)
 screen.set_screen_bg_color(0x000000,scr2)
 
 # Init labels on screen 2
-labelScreen2Title     = M5Label('In target range (last 24h)', x=9, y=0, color=0xffffff, font=FONT_MONT_22, parent=scr2)
-labelAboveTarget      = M5Label('Above target 180 mg/dl:', x=9, y=60, color=0xffc418, font=FONT_MONT_18, parent=scr2)
-labelInTarget         = M5Label('In target:', x=9, y=90, color=0x45db49, font=FONT_MONT_18, parent=scr2)
-labelBelowTarget      = M5Label('Below target 70 mg/dl:', x=9, y=119, color=0xff0000, font=FONT_MONT_18, parent=scr2)
-labelAgerageSg        = M5Label('Average SG:', x=9, y=147, color=0xa0a0a0, font=FONT_MONT_18, parent=scr2)
-labelAboveTargetValue = M5Label('-- %', x=252, y=60, color=0xffffff, font=FONT_MONT_18, parent=scr2)
-labelInTargetValue    = M5Label('-- %', x=252, y=90, color=0xffffff, font=FONT_MONT_18, parent=scr2)
-labelBelowTargetValue = M5Label('-- %', x=252, y=119, color=0xffffff, font=FONT_MONT_18, parent=scr2)
-labelAverageSgValue   = M5Label('-- mg/dl', x=231, y=147, color=0xffffff, font=FONT_MONT_18, parent=scr2)
+# (text, x, y, color, font)
+LABEL_DEFS_SCR2 = (('In target range (last 24h)',9,0,0xffffff,FONT_MONT_22),
+                   ('Above target 180 mg/dl:',9,60,0xffc418,FONT_MONT_18),
+                   ('In target:',9,90,0x45db49,FONT_MONT_18),
+                   ('Below target 70 mg/dl:',9,119,0xff0000,FONT_MONT_18),
+                   ('Average SG:',9,147,0xa0a0a0,FONT_MONT_18),
+                   ('-- %',252,60,0xffffff,FONT_MONT_18),
+                   ('-- %',252,90,0xffffff,FONT_MONT_18),
+                   ('-- %',252,119,0xffffff,FONT_MONT_18),
+                   ('-- mg/dl',231,147,0xffffff,FONT_MONT_18))
+labelScreen2Title,labelAboveTarget,labelInTarget,labelBelowTarget,labelAgerageSg, \
+labelAboveTargetValue,labelInTargetValue,labelBelowTargetValue,labelAverageSgValue = \
+   [M5Label(text, x=x, y=y, color=color, font=font, parent=scr2) for text,x,y,color,font in LABEL_DEFS_SCR2]
 
 # Create screen 3
 scr3 = screen.get_new_screen()
@@ -419,20 +628,29 @@ btn0.released(btn0_wasReleased)
 
 # Init button A
 def buttonA_wasPressed():
-  # global params
+  global activeScr, calibRedraw
   screen.load_screen(scr1)
+  activeScr = scr1
+  # Screen reload clears the calibration arc (drawn directly on LCD)
+  calibRedraw = True
 btnA.wasPressed(buttonA_wasPressed)
 
 # Init button B
 def buttonB_wasPressed():
-  # global params
+  global activeScr
+  # Apply values received while screen 2 was not shown
+  for label,text in scr2Pending.values():
+     update_text(label,text)
+  scr2Pending.clear()
   screen.load_screen(scr2)
+  activeScr = scr2
 btnB.wasPressed(buttonB_wasPressed)
 
 # Init button C
 def buttonC_wasPressed():
-  # global params
+  global activeScr
   screen.load_screen(scr3)
+  activeScr = scr3
 btnC.wasPressed(buttonC_wasPressed)
 
 
@@ -442,6 +660,65 @@ btnC.wasPressed(buttonC_wasPressed)
 #
 #################################################
 
+def update_img(image,img_file):
+   # Change image source only if different from the one shown
+   # (returns True if changed)
+   key = (id(image),"img")
+   if uiCache.get(key) != img_file:
+      image.set_img_src(img_file)
+      uiCache[key] = img_file
+      return True
+   return False
+
+
+def update_hidden(widget,hidden):
+   # Hide or show widget only if its state has changed
+   key = (id(widget),"hidden")
+   if uiCache.get(key) != hidden:
+      widget.set_hidden(hidden)
+      uiCache[key] = hidden
+
+
+def update_text(label,text,pos=None,y=0):
+   # Change label text only if different from the one shown
+   # (and align it again only then, as its width has not changed otherwise)
+   key = (id(label),"text")
+   if uiCache.get(key) != text:
+      label.set_text(text)
+      uiCache[key] = text
+      if pos != None:
+         align_text(label,pos,y)
+
+
+def show_msgbox(msgbox,text,y):
+   # Message boxes on screen 1 are created on first use and then
+   # only hidden and shown again (returns the message box)
+   if msgbox == None:
+      msgbox = M5Msgbox(btns_list=None, x=0, y=y, w=None, h=None, parent=scr1)
+   update_text(msgbox,text)
+   update_hidden(msgbox,False)
+   return msgbox
+
+
+def hide_msgbox(msgbox):
+   global calibRedraw
+   if msgbox != None and uiCache.get((id(msgbox),"hidden")) != True:
+      update_hidden(msgbox,True)
+      # LVGL repaints the area below the message box, which
+      # also wipes the calibration arc drawn directly on the LCD
+      calibRedraw = True
+
+
+def update_scr2_text(label,text):
+   # Screen 2 labels are only updated while screen 2 is shown,
+   # otherwise the text is kept until the screen is loaded
+   if activeScr == scr2:
+      update_text(label,text)
+   else:
+      scr2Pending[id(label)] = (label,text)
+
+
+@micropython.native
 def align_text(label,pos,y):
     if pos=="left":
         label.set_pos(x=0,y=y)
@@ -451,6 +728,7 @@ def align_text(label,pos,y):
         label.set_pos(x=320-label.get_width(),y=y)
 
 
+@micropython.native
 def time_delta(tm,ntp,timezone):
    if tm != None and ntp != None:
       delta_min  = ntp.minute() - tm[4]
@@ -467,12 +745,13 @@ def time_delta(tm,ntp,timezone):
       elif delta_min > 15 or delta_hour > 1:
          delta_txt = "No data"
       else:
-         delta_txt = str(delta_min)+" min ago"
+         delta_txt = "%d min ago" % delta_min
    else:
       delta_txt = "---"
    return delta_txt
 
 
+@micropython.native
 def reservoir_level(lvl):
    if lvl > 150:
       img_lvl = 200  # green
@@ -485,51 +764,48 @@ def reservoir_level(lvl):
    return img_lvl
 
 
+@micropython.native
 def time_to_calib_progress(ttc,sst,cst):
-   # TODO: check if screen 1 is active
-   centerX = 112
-   centerY = 17
-   radius  = 16
-   thick   = 4
-   endposfull = 359
-   endpos = int(360*((12-ttc)/12))
-   endpos = min(endpos,endposfull)
-   endpos = max(endpos,0)
-   if ttc == 255 or cst == "UNKNOWN": # unknown
-      #print("unknown")
-      # full blue circle, question mark
-      imageDrop.set_img_src("res/mm_drop_unk.png")
-      imageDrop.set_pos(106, 8)
-      lcd.arc(centerX, centerY, radius, thick, 0, endposfull,0x00cccc,0x00cccc)
-   elif ttc >= 12: 
-      # full green circle, white drop
-      imageDrop.set_img_src("res/mm_drop_white.png")
-      imageDrop.set_pos(105, 8)
-      lcd.arc(centerX, centerY, radius, thick, 0, endposfull,0x33cc00,0x33cc00)
+   global calibProgress, calibRedraw, calibArc
+   # Nothing to do if the calibration state has not changed since the last draw
+   if (ttc,sst,cst) == calibProgress and not calibRedraw:
+      return
+   calibProgress = (ttc,sst,cst)
+   endpos = max(0,min(CALIB_ARC_END,(360*(12-ttc))//12))
+   if ttc == 255 or cst == "UNKNOWN":
+      state = "unknown"
+   elif ttc >= 12:
+      state = "full"
    elif ttc > 3:
-      # decreasing green circle, white drop
-      imageDrop.set_img_src("res/mm_drop_white.png")
-      imageDrop.set_pos(105, 8)
-      lcd.arc(centerX, centerY, radius, thick, 0, endposfull,0x33cc00,0x33cc00)
-      lcd.arc(centerX, centerY, radius, thick, 0, endpos,0x000000,0x000000)
+      state = "green"
    elif ttc > 0:
-      # decreasing red circle, white drop
-      imageDrop.set_img_src("res/mm_drop_white.png")
-      imageDrop.set_pos(105, 8)
-      lcd.arc(centerX, centerY, radius, thick, 0, endposfull,0xff0000,0xff0000)
-      lcd.arc(centerX, centerY, radius, thick, 0, endpos,0x000000,0x000000)
+      state = "red"
+   elif sst == "CALIBRATION_REQUIRED":
+      state = "required"
    else:
-      if sst == "CALIBRATION_REQUIRED":
-         # no circle, red drop
-         imageDrop.set_img_src("res/mm_drop_red.png")
-         imageDrop.set_pos(100, 0)
-      else:
-         # no circle, white drop
-         imageDrop.set_img_src("res/mm_drop_white.png")
-         imageDrop.set_pos(105, 8)
-      lcd.arc(centerX, centerY, radius, thick, 0, endposfull,0x000000,0x000000)
+      state = "none"
+   img_file,x,y,color,decreasing = CALIB_STATES[state]
+   if update_img(imageDrop,img_file):
+      imageDrop.set_pos(x, y)
+   
+   # The arc is drawn directly on the LCD, so only while screen 1 is shown
+   if activeScr != scr1:
+      calibRedraw = True
+      return
+   blackpos = endpos if decreasing else 0
+   if not calibRedraw and calibArc != None and calibArc[0] == color and calibArc[1] <= blackpos:
+      # Same circle as before, only blacken the part elapsed since the last draw
+      if blackpos > calibArc[1]:
+         lcd.arc(CALIB_ARC_X, CALIB_ARC_Y, CALIB_ARC_R, CALIB_ARC_THICK, calibArc[1], blackpos,0x000000,0x000000)
+   else:
+      lcd.arc(CALIB_ARC_X, CALIB_ARC_Y, CALIB_ARC_R, CALIB_ARC_THICK, 0, CALIB_ARC_END,color,color)
+      if decreasing:
+         lcd.arc(CALIB_ARC_X, CALIB_ARC_Y, CALIB_ARC_R, CALIB_ARC_THICK, 0, blackpos,0x000000,0x000000)
+   calibArc = (color, blackpos)
+   calibRedraw = False
 
 
+@micropython.native
 def sensor_age_text(rem_hours):
    if rem_hours == 255:
       text = ""
@@ -540,6 +816,7 @@ def sensor_age_text(rem_hours):
    return text
    
 
+@micropython.native
 def sensor_age_icon(rem_hours, sensor_state):
    if sensor_state == "CHANGE_SENSOR":
       icon = "expired"
@@ -555,52 +832,57 @@ def sensor_age_icon(rem_hours, sensor_state):
 def convert_datetimestr_to_epoch(datetimestr):
    # datetime string format is the following:
    # yyyy-mm-ddThh:mm:ss.000-00:00
+   # (fixed layout, so the fields are sliced at known positions)
    try:
-      d  = datetimestr.split('.')[0].split('T')[0]
-      t  = datetimestr.split('.')[0].split('T')[1]
-      year = int(d.split('-')[0])
-      mon  = int(d.split('-')[1])
-      day  = int(d.split('-')[2])
-      hour = int(t.split(':')[0])
-      min  = int(t.split(':')[1])
-      sec  = int(t.split(':')[2])
+      year = int(datetimestr[0:4])
+      mon  = int(datetimestr[5:7])
+      day  = int(datetimestr[8:10])
+      hour = int(datetimestr[11:13])
+      min  = int(datetimestr[14:16])
+      sec  = int(datetimestr[17:19])
       #print("%d-%d-%d %d:%d:%d"%(year,mon,day,hour,min,sec))
       return time.mktime((year,mon,day,hour,min,sec,0,0,dstDelta))
    except:
       return 0
 
+
+def alarm_text(messageId):
+   # Convert message id to text, e.g. BC_SID_LOW_SG -> "LOW SG"
+   # (converted texts are kept so a repeated alarm is a single lookup)
+   msg = alarmTexts.get(messageId)
+   if msg == None:
+      msg = " ".join(messageId.split('_')[2:])
+      alarmTexts[messageId] = msg
+   return msg
+
    
 def handle_alarm(lastAlarm):
-   TDELTA_S = 15*60 # 15 min in seconds
    global lastAlarmId
    global lastAlarmMsg
    
-   # Delete previous alarm message
-   if lastAlarmMsg != None:
-      lastAlarmMsg.delete() 
-      lastAlarmMsg = None
+   # Hide previous alarm message
+   hide_msgbox(lastAlarmMsg)
+
+   # Check for new alarm
+   # (no alarm or the same one as last time is the usual case)
+   if not isinstance(lastAlarm, dict) or lastAlarm.get("instanceId",lastAlarmId) == lastAlarmId:
+      return
 
    try:
-      # Check for new alarm
-      if lastAlarmId != lastAlarm["instanceId"]:
-         # Check if alarm is recent   
-         if convert_datetimestr_to_epoch(lastAlarm["datetime"]) > (time.time() - TDELTA_S):
-            # Show alarm message
-            msg = lastAlarm["messageId"].split('_')[2:]
-            if lastAlarmMsg != None:
-               lastAlarmMsg.delete()
-            lastAlarmMsg = M5Msgbox(btns_list=None, x=0, y=100, w=None, h=None, parent=scr1)
-            lastAlarmMsg.set_text(" ".join(msg))
-            
-            # Play alarm sound
-            if lastAlarm["kind"] == "ALARM":
-               sndfile = "res/sound_alarm.wav"
-            else:
-               sndfile = "res/sound_alert.wav"
-            speaker.playWAV(sndfile, rate=22000)
-         lastAlarmId = lastAlarm["instanceId"]
-   except:
+      # Check if alarm is recent   
+      if convert_datetimestr_to_epoch(lastAlarm["datetime"]) > (time.time() - ALARM_MAX_AGE_S):
+         # Show alarm message
+         lastAlarmMsg = show_msgbox(lastAlarmMsg,alarm_text(lastAlarm["messageId"]),100)
+         
+         # Play alarm sound
+         if lastAlarm["kind"] == "ALARM":
+            sndfile = "res/sound_alarm.wav"
+         else:
+            sndfile = "res/sound_alert.wav"
+         speaker.playWAV(sndfile, rate=22000)
+   except (KeyError, TypeError, AttributeError):
       pass
+   lastAlarmId = lastAlarm["instanceId"]
         
         
 #################################################
@@ -609,129 +891,202 @@ def handle_alarm(lastAlarm):
 #
 #################################################
 
-@timerSch.event('timer0')
-def ttimer0():
-   global runNtpsync
-   runNtpsync = True
-
-def handle_ntpsync(ntpserver, timezone):
+def handle_ntpsync(ntp, ntpserver, timezone):
+   global ntpTz
+   global ntpPeriod
    # Periodic timer: sync time via NTP
-   try:
-      ntp = ntptime.client(host=ntpserver, timezone=int(timezone)+dstDelta)
-      #print("time: %02d:%02d (tz:%d, dd:%d)" % (ntp.hour(),ntp.minute(),int(timezone),dstDelta))
-   except:
-      ntp = None
+   # (the client is only created again when the DST offset has changed,
+   #  otherwise the existing one just resyncs the time)
+   for retry in range(2):
+      try:
+         if ntp == None or ntpTz != int(timezone)+dstDelta:
+            ntp = ntptime.client(host=ntpserver, timezone=int(timezone)+dstDelta)
+            ntpTz = int(timezone)+dstDelta
+         else:
+            tm = time.time()
+            ntp.updateTime()
+            # Adapt sync period to the clock correction
+            # (double it while the clock keeps good time, halve it otherwise)
+            drift = abs(time.time() - tm)
+            if drift <= 1:
+               ntpPeriod = min(2*ntpPeriod, NTP_MAX_PERIOD_S)
+            elif drift > 2:
+               ntpPeriod = max(ntpPeriod//2, NTP_MIN_PERIOD_S)
+         #print("time: %02d:%02d (tz:%d, dd:%d)" % (ntp.hour(),ntp.minute(),int(timezone),dstDelta))
+         break
+      except:
+         wait_ms(1000)
+   # On failure keep the old client, the RTC time is still valid
    return ntp
 
 
-@timerSch.event('timer1')
-def ttimer1():
-   global runTimeupdate
-   runTimeupdate = True
-
 def handle_timeupdate(ntp, timezone):
    try:
       # Update display time
       time = ("%02d:%02d") % (ntp.hour(),ntp.minute())
-      labelTime.set_text(time)
-      align_text(labelTime,"right",0)
-      labelLastData.set_text(time_delta(lastUpdateTm,ntp,timezone))
-      align_text(labelLastData,"center",218)
+      update_text(labelTime,time,"right",0)
+      update_text(labelLastData,time_delta(lastUpdateTm,ntp,timezone),"center",218)
    except:
       pass
 
 
-@timerSch.event('timer2')
-def ttimer2():
-   global runPumpdataupdate
-   runPumpdataupdate = True
+def next_minute_ms():
+   # Time until the clock shows the next minute
+   # (the time zone offset is whole hours, so UTC seconds will do)
+   return (60 - time.time() % 60)*1000
+
+
+def poll_retry_period():
+   # The next sensor data is late: retry after 30 sec first,
+   # then with a doubling period up to 120 sec
+   global pollRetry
+   if pollRetry:
+      return min(2*pollPeriod, POLL_RETRY_MAX_S)
+   pollRetry = True
+   return POLL_MIN_PERIOD_S
+
 
 def handle_pumpdataupdate(proxyaddr, proxyport):
    global lastErrorMsg
    global lastUpdateTm
    global dstDelta
-   proxy_url = "http://%s:%s/%s" % (proxyaddr, proxyport, API_URL)
+   global lastConduitTs
+   global lastTzName
+   global pollPeriod
+   global pollRetry
+   global lastContent
+   global lastEtag
 
    # Update Minimed data
    
    # Get Minimed data from proxy via API
-   # (urequests does not handle timeouts so we do this with an external timer)
-   timerSch.run('timer5', TIMER5_PERIOD_S*1000, 0x01)
+   # (the socket timeout aborts a stuck request)
+   hide_msgbox(lastErrorMsg)
    try:
-      r = urequests.request(method='GET', url=proxy_url, headers={})
+      r = http_get(proxyaddr, proxyport, API_URL, lastEtag)
    except OSError:
       r = None
-   timerSch.stop('timer5')
-   if lastErrorMsg != None:
-      lastErrorMsg.delete()
-      lastErrorMsg = None
+      lastErrorMsg = show_msgbox(lastErrorMsg,"ERROR: no response from Carelink proxy",0)
    
-   if r != None and r.status_code == 200 and r.json() != "":
+   # Nothing to update if the proxy reports no change (304) or sends
+   # the same data as last time (it only gets new data from Carelink
+   # every few minutes), just remove the alarm message and retry
+   # like for unchanged pump data
+   if r != None and (r.status_code == 304 and lastContent != None or
+                     r.status_code == 200 and r.content == lastContent):
+      r.close()
+      handle_alarm(None)
+      pollPeriod = poll_retry_period()
+      return pollPeriod
+   
+   # Parse response body once
+   data = None
+   lastContent = None
+   lastEtag = None
+   if r != None and r.status_code == 200:
+      try:
+         data = r.json()
+         lastContent = r.content
+         lastEtag = r.etag
+      except ValueError:
+         data = None
+   if r != None:
+      # Response body is not needed anymore
+      r.close()
+      r = None
+   
+   # (anything but a dict is not valid pump data)
+   if isinstance(data, dict):
       try:
-         lastUpdateTm = time.localtime(int(r.json()["lastConduitUpdateServerTime"]/1000)) #-NTPCONST)
+         conduitTs = data["lastConduitUpdateServerTime"]
+         lastUpdateTm = time.localtime(int(conduitTs/1000)) #-NTPCONST)
+         
+         # Schedule next request shortly after the next sensor data is due.
+         # If the data did not change since the last request, the next sample
+         # is late: retry sooner, with a period doubling from 30 s up to 120 s
+         if conduitTs != lastConduitTs:
+            lastConduitTs = conduitTs
+            age = int((data.get("currentServerTime",lastConduitTs) - lastConduitTs)/1000)
+            pollPeriod = max(POLL_MIN_PERIOD_S, CGM_PERIOD_S - age + 10)
+            pollRetry = False
+         else:
+            pollPeriod = poll_retry_period()
          
-         # Check for DST
-         dstDelta = 1 if r.json()["clientTimeZoneName"].lower().find("summer")>-1 else 0
+         # Check for DST (only when the time zone name has changed)
+         if data["clientTimeZoneName"] != lastTzName:
+            lastTzName = data["clientTimeZoneName"]
+            tzName = lastTzName.lower()
+            dstDelta = 1 if "summer" in tzName or "daylight" in tzName else 0
          
          # Check for alarm notification
-         handle_alarm(r.json()["lastAlarm"])
+         handle_alarm(data.get("lastAlarm"))
          
          # Check conduit, medical device in range
-         haveData = r.json()["conduitInRange"] and r.json()["conduitMedicalDeviceInRange"]
+         haveData = data["conduitInRange"] and data["conduitMedicalDeviceInRange"]
 
          ##### Screen 1 #####
          
+         sensorState = data["sensorState"]
+         sensorHours = data["sensorDurationHours"]
          if haveData:
-            imageBattery.set_img_src("res/mm_batt"+str(r.json()["medicalDeviceBatteryLevelPercent"])+".png")
-            imageReservoir.set_img_src("res/mm_tank"+str(reservoir_level(r.json()["reservoirRemainingUnits"]))+".png")
-            imageSage.set_img_src("res/mm_sage_"+sensor_age_icon(r.json()["sensorDurationHours"],r.json()["sensorState"])+".png")
-            labelSage.set_text(sensor_age_text(r.json()["sensorDurationHours"]))
+            update_img(imageBattery,IMG_BATTERY.get(data["medicalDeviceBatteryLevelPercent"],"res/mm_batt_unk.png"))
+            update_img(imageReservoir,IMG_RESERVOIR[reservoir_level(data["reservoirRemainingUnits"])])
+            update_img(imageSage,IMG_SAGE[sensor_age_icon(sensorHours,sensorState)])
+            update_text(labelSage,sensor_age_text(sensorHours))
          else:
-            imageBattery.set_img_src("res/mm_batt_unk.png")
-            imageReservoir.set_img_src("res/mm_tank_unk.png")
-            imageSage.set_img_src("res/mm_sage_unk.png")
-            labelSage.set_text("")
+            update_img(imageBattery,"res/mm_batt_unk.png")
+            update_img(imageReservoir,"res/mm_tank_unk.png")
+            update_img(imageSage,"res/mm_sage_unk.png")
+            update_text(labelSage,"")
          
-         if r.json()["conduitSensorInRange"]:
-            imageSensorConn.set_img_src("res/mm_sensor_connection_ok.png")
+         if data["conduitSensorInRange"]:
+            update_img(imageSensorConn,"res/mm_sensor_connection_ok.png")
          else:
-            imageSensorConn.set_img_src("res/mm_sensor_connection_nok.png")
+            update_img(imageSensorConn,"res/mm_sensor_connection_nok.png")
          
-         time_to_calib_progress(r.json()["timeToNextCalibHours"],r.json()["sensorState"],r.json()["calibStatus"])
+         time_to_calib_progress(data["timeToNextCalibHours"],sensorState,data["calibStatus"])
          
-         if not haveData or r.json()["therapyAlgorithmState"]["autoModeShieldState"] == "FEATURE_OFF":
-            imageShield.set_hidden(True)
+         if not haveData or data["therapyAlgorithmState"]["autoModeShieldState"] == "FEATURE_OFF":
+            update_hidden(imageShield,True)
          else:
-            imageShield.set_img_src("res/mm_shield_"+r.json()["lastSGTrend"].lower()+".png")
-            imageShield.set_hidden(False)
-         lastSG = r.json()["lastSG"]["sg"]
-         labelBglValue.set_text(str(lastSG) if lastSG > 0 else "--")
-         align_text(labelBglValue,"center",90)
+            update_img(imageShield,IMG_SHIELD.get(data["lastSGTrend"],"res/mm_shield_none.png"))
+            update_hidden(imageShield,False)
+         lastSG = data["lastSG"]["sg"]
+         update_text(labelBglValue,str(lastSG) if lastSG > 0 else "--","center",90)
          
          if haveData:
-            labelActInsValue.set_text(str(r.json()["activeInsulin"]["amount"])+" U")
+            update_text(labelActInsValue,"%s U" % data["activeInsulin"]["amount"],"right",173)
          else:
-            labelActInsValue.set_text("-- U")
-         align_text(labelActInsValue,"right",173)
+            update_text(labelActInsValue,"-- U","right",173)
       except:
          pass
       
+      # No banner shown if pump banner list is empty
+      # (the usual case, so it is checked instead of raising an exception)
+      pumpBanner = data.get("pumpBannerState")
       try:
-         pumpBanner = r.json()["pumpBannerState"][0]["type"]
-         imageBanner.set_img_src("res/mm_banner_"+pumpBanner.lower()+".png")
-         imageBanner.set_hidden(False)
-      except:
-         imageBanner.set_hidden(True)
+         bannerImg = IMG_BANNER.get(pumpBanner[0]["type"]) if pumpBanner else None
+      except (KeyError, TypeError):
+         bannerImg = None
+      if bannerImg != None:
+         update_img(imageBanner,bannerImg)
+         update_hidden(imageBanner,False)
+      else:
+         update_hidden(imageBanner,True)
          
       ##### Screen 2 #####
       try:
-         labelAboveTargetValue.set_text(str(r.json()["aboveHyperLimit"])+" %")
-         labelInTargetValue.set_text(str(r.json()["timeInRange"])+" %")
-         labelBelowTargetValue.set_text(str(r.json()["belowHypoLimit"])+" %")
-         labelAverageSgValue.set_text(str(r.json()["averageSG"])+" mg/dl")
+         update_scr2_text(labelAboveTargetValue,"%s %%" % data["aboveHyperLimit"])
+         update_scr2_text(labelInTargetValue,"%s %%" % data["timeInRange"])
+         update_scr2_text(labelBelowTargetValue,"%s %%" % data["belowHypoLimit"])
+         update_scr2_text(labelAverageSgValue,"%s mg/dl" % data["averageSG"])
       except:
          pass
    
+   if not isinstance(data, dict) or pollPeriod == None:
+      pollPeriod = TIMER2_PERIOD_S
+   return pollPeriod
+   
 
 @timerSch.event('timer3')
 def ttimer3():
@@ -739,31 +1094,29 @@ def ttimer3():
    handle_touchevent()
 
 def handle_touchevent():
-   global lastAlarmMsg
-   if touch.status():
-      if lastAlarmMsg != None:
-         lastAlarmMsg.delete() 
-         lastAlarmMsg = None
-      screen.set_screen_brightness(100)
-      timerSch.run('timer4', TIMER4_PERIOD_S*1000, 0x01)
+   global lastTouch
+   global screenBright
+   # Act only when the screen is touched or released
+   touched = touch.status()
+   if touched == lastTouch:
+      return
+   lastTouch = touched
+   if touched:
+      hide_msgbox(lastAlarmMsg)
+      if not screenBright:
+         screen.set_screen_brightness(100)
+         screenBright = True
+   # Dim screen again some time after the last touch
+   timerSch.run('timer4', TIMER4_PERIOD_S*1000, 0x01)
 
 
 @timerSch.event('timer4')
 def ttimer4():
    # One shot timer: reset screen brightness
-   screen.set_screen_brightness(40)
-
-
-@timerSch.event('timer5')
-def ttimer5():
-   # One shot timer: urequests watchdog
-   # Just issue a warning nessage
-   global lastErrorMsg
-   if lastErrorMsg != None:
-      lastErrorMsg.delete()
-      lastErrorMsg = None
-   lastErrorMsg = M5Msgbox(btns_list=None, x=0, y=0, w=None, h=None, parent=scr1)
-   lastErrorMsg.set_text("ERROR: urequests is stuck, reset device")
+   global screenBright
+   if not lastTouch:
+      screen.set_screen_brightness(40)
+      screenBright = False
 
 
 #################################################
@@ -772,47 +1125,74 @@ def ttimer5():
 #
 #################################################
 
+NTP_BURST_COUNT  = const(4)
+NTP_RETRY_MAX_MS = const(60000)
+
+# Sync time and date, wait longer after each failed attempt
 ntp = None
 msgbox = None
-while ntp == None:
-   wait_ms(1000)
-   ntp = handle_ntpsync(ntpserver, timezone)
-   if ntp == None and msgbox == None:
+retryDelay = 1000
+while True:
+   ntp = handle_ntpsync(ntp, ntpserver, timezone)
+   if ntp != None:
+      break
+   if msgbox == None:
       msgbox = M5Msgbox(btns_list=None, x=0, y=0, w=None, h=None, parent=scr1)
       msgbox.set_text("Trying to synch time and date ...")
+   wait_ms(retryDelay)
+   retryDelay = min(2*retryDelay, NTP_RETRY_MAX_MS)
 if msgbox != None:
    msgbox.delete()
 
+# Send a few more requests to settle the clock (like NTP iburst)
+for i in range(NTP_BURST_COUNT-1):
+   wait_ms(2000)
+   try:
+      ntp.updateTime()
+   except:
+      pass
+
 print("Time and date successfully synched")
 
 # Init timers
+# (timers 0-2 are run by the main loop which sleeps until the next one is due)
 
-# Timer 0: 1200 sec (periodic) // ntpsync
-TIMER0_PERIOD_S = 1200
-timerSch.run('timer0', TIMER0_PERIOD_S*1000, 0x00)
+# Timer 0: 64-8192 sec (adaptive) // ntpsync
+TIMER0_PERIOD_S  = const(3600)
+NTP_MIN_PERIOD_S = const(64)   # 2**6
+NTP_MAX_PERIOD_S = const(8192) # 2**13
+ntpPeriod = TIMER0_PERIOD_S
 
-# Timer 1: 10 sec (periodic) // timeupdate
-TIMER1_PERIOD_S = 10
-timerSch.run('timer1', TIMER1_PERIOD_S*1000, 0x00)
+# Timer 1: 60 sec (aligned to the minute) // timeupdate
 
-# Timer 2: 60 sec (periodic) // pumpdataupdate
-TIMER2_PERIOD_S = 60
-timerSch.run('timer2', TIMER2_PERIOD_S*1000, 0x00)
+# Timer 2: 30-310 sec (adaptive) // pumpdataupdate
+# (up to 310 sec until the next sensor data is due, then retry
+#  with a period doubling from 30 sec up to 120 sec while it is late)
+TIMER2_PERIOD_S   = const(60)  # after failed request
+POLL_MIN_PERIOD_S = const(30)
+POLL_RETRY_MAX_S  = const(120) # while data did not change
 
 # Timer 3: 0.2 sec (periodic) // touchevent
 TIMER3_PERIOD_S = 0.2
 timerSch.run('timer3', int(TIMER3_PERIOD_S*1000), 0x00)
 
 # Timer 4: 10 sec (one shot) // reset screen brightness
-TIMER4_PERIOD_S = 10
+TIMER4_PERIOD_S = const(10)
+
+# Run time and pump data update immediately to init
+# (time and date have just been synched)
+now = time.ticks_ms()
+nextNtpsync        = time.ticks_add(now, TIMER0_PERIOD_S*1000)
+nextTimeupdate     = now
+nextPumpdataupdate = now
 
-# Timer 5: 60 sec (one shot) // urequest watchdog
-TIMER5_PERIOD_S = 60
+# Wake up at least every 10 sec
+# (to redraw the calibration arc after switching back to screen 1)
+LOOP_MAX_SLEEP_S = const(10)
 
-# Run some timer functions immediately to init
-ttimer0()
-ttimer1()
-ttimer2()
+# Run garbage collection every few loops
+GC_LOOP_COUNT = const(10)
+loopCount = 0
 
 
 #################################################
@@ -821,15 +1201,35 @@ ttimer2()
 #
 #################################################
 while True:
-   # Run handlers as requested
-   if runPumpdataupdate:
-      handle_pumpdataupdate(proxyaddr, proxyport)
-      runPumpdataupdate = False
-   if runNtpsync:
-      ntp = handle_ntpsync(ntpserver, timezone)
-      runNtpsync = False
-   if runTimeupdate:
+   # Run handlers which are due
+   now = time.ticks_ms()
+   if time.ticks_diff(nextPumpdataupdate, now) <= 0:
+      period = handle_pumpdataupdate(proxyaddr, proxyport)
+      nextPumpdataupdate = time.ticks_add(now, period*1000)
+      # Show the age of the new data right away
+      nextTimeupdate = now
+   if time.ticks_diff(nextNtpsync, now) <= 0 or ntpTz != int(timezone)+dstDelta:
+      ntp = handle_ntpsync(ntp, ntpserver, timezone)
+      nextNtpsync = time.ticks_add(now, ntpPeriod*1000)
+   if time.ticks_diff(nextTimeupdate, now) <= 0:
       handle_timeupdate(ntp, timezone)
-      runTimeupdate = False
+      nextTimeupdate = time.ticks_add(now, next_minute_ms())
+   
+   # Redraw calibration arc after switching back to screen 1
+   if calibRedraw and calibProgress != None:
+      time_to_calib_progress(*calibProgress)
+   
+   # Free memory while idle, not in the middle of a screen update
+   loopCount += 1
+   if loopCount >= GC_LOOP_COUNT:
+      gc.collect()
+      loopCount = 0
    
-   wait_ms(1000)
+   # Sleep until the next handler is due
+   now = time.ticks_ms()
+   delay = min(time.ticks_diff(nextPumpdataupdate, now),
+               time.ticks_diff(nextNtpsync, now),
+               time.ticks_diff(nextTimeupdate, now),
+               LOOP_MAX_SLEEP_S*1000)
+   if delay > 0:
+      wait_ms(delay)